@@ -26,7 +26,6 @@ from spimagine.volumerender.volumerender import VolumeRenderer
 from spimagine.models.transform_model import mat4_rotation, mat4_translate, mat4_scale, mat4_ortho, mat4_perspective
 
 
-from scipy.misc import toimage
 from imageio import imsave
 import six
 
@@ -139,12 +138,17 @@ def main():
         #     img.save(args.output)
 
     else:
+        cmin, cmax = np.amin(out), np.amax(out)
         if not args.range:
-            print("min/max: ", np.amin(out), np.amax(out))
-            img = toimage(out, low = np.amin(out), high  = np.amax(out),mode = "I")
+            print("min/max: ", cmin, cmax)
+            low, high = cmin, cmax
         else:
-            img = toimage(out, low = args.range[0], high  = args.range[1], mode = "I")
-        img.save(args.output)
+            low, high = args.range
+
+        # map the data range [cmin,cmax] to [low,high], as
+        # scipy.misc.toimage used to
+        img = (low+(out-cmin)*(high-low)/max(cmax-cmin, 1.e-40))
+        imsave(args.output, img.astype(np.uint16))
 
 
 if __name__ == '__main__':
@@ -145,17 +145,17 @@ def fillTexture2d(data,tex = None, interp=True):
     if data.ndim == 2:
         Ny,Nx = data.shape
         GL.glTexImage2D(GL.GL_TEXTURE_2D, 0, GL.GL_RGB, Nx, Ny,
-                     0, GL.GL_RED, GL.GL_FLOAT, data.astype(np.float32))
+                     0, GL.GL_RED, GL.GL_FLOAT, np.ascontiguousarray(data, dtype=np.float32))
 
     elif data.ndim == 3 and data.shape[2]==3:
         Ny,Nx = data.shape[:2]
         GL.glTexImage2D(GL.GL_TEXTURE_2D, 0, GL.GL_RGB, Nx, Ny,
-                         0, GL.GL_RGB, GL.GL_FLOAT, data.astype(np.float32))
+                         0, GL.GL_RGB, GL.GL_FLOAT, np.ascontiguousarray(data, dtype=np.float32))
 
     elif data.ndim == 3 and data.shape[2]==4:
         Ny,Nx = data.shape[:2]
         GL.glTexImage2D(GL.GL_TEXTURE_2D, 0, GL.GL_RGBA, Nx, Ny,
-                         0, GL.GL_RGBA, GL.GL_FLOAT, data.astype(np.float32))
+                         0, GL.GL_RGBA, GL.GL_FLOAT, np.ascontiguousarray(data, dtype=np.float32))
 
     else:
         raise Exception("data format not supported! \ndata.shape should be either (Ny,Nx) or (Ny,Nx,3)")
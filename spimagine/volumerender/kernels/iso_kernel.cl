@@ -30,8 +30,7 @@ __kernel void iso_surface(
 						  float gamma,
 						  __QUALIFIER_CONSTANT float* invP,
 						  __QUALIFIER_CONSTANT float* invM,
-						  __read_only image3d_t volume,
-						  int isShortType)
+						  __read_only image3d_t volume)
 {
   const sampler_t volumeSampler =   CLK_NORMALIZED_COORDS_TRUE |
 	CLK_ADDRESS_CLAMP_TO_EDGE | SAMPLER_FILTER;
@@ -118,7 +117,7 @@ __kernel void iso_surface(
 	t_hit = tnear +i*dt;
 
     //newVal = read_imagef(volume, volumeSampler, pos).x;
-	newVal = read_image(volume, volumeSampler, pos, isShortType);
+	newVal = read_image(volume, volumeSampler, pos);
 
 
     if ((newVal>isoVal) != isGreater){
@@ -152,7 +151,7 @@ __kernel void iso_surface(
 
   int j = 1;
   for(j=1; j<=maxBisect; j++) {
-  	newVal = read_image(volume, volumeSampler, pos, isShortType);
+  	newVal = read_image(volume, volumeSampler, pos);
     pos += delta_pos2;
 	t_hit += dt2;
 	if ((newVal>isoVal) != isGreater){
@@ -180,20 +179,20 @@ __kernel void iso_surface(
   h*= pow(gamma,2);
 
   // robust 2nd order
-  normal.x = 2.f*read_image(volume,volumeSampler,pos+(float4)(h,0,0,0), isShortType)-
-  	2.f*read_image(volume,volumeSampler,pos+(float4)(-h,0,0,0), isShortType)+
-	read_image(volume,volumeSampler,pos+(float4)(2.f*h,0,0,0), isShortType)-
-  	read_image(volume,volumeSampler,pos+(float4)(-2.f*h,0,0,0), isShortType);
-
-  normal.y = 2.f*read_image(volume,volumeSampler,pos+(float4)(0,h,0,0), isShortType)-
-  	2.f*read_image(volume,volumeSampler,pos+(float4)(0,-h,0,0), isShortType)+
-	read_image(volume,volumeSampler,pos+(float4)(0,2.f*h,0,0), isShortType)-
-  	read_image(volume,volumeSampler,pos+(float4)(0,-2.f*h,0,0), isShortType);
-
-  normal.z = read_image(volume,volumeSampler,pos+(float4)(0,0,h,0), isShortType)-
-  	read_image(volume,volumeSampler,pos+(float4)(0,0,-h,0), isShortType)+
-	read_image(volume,volumeSampler,pos+(float4)(0,0,2.f*h,0), isShortType)-
-  	read_image(volume,volumeSampler,pos+(float4)(0,0,-2.f*h,0), isShortType);
+  normal.x = 2.f*read_image(volume,volumeSampler,pos+(float4)(h,0,0,0))-
+  	2.f*read_image(volume,volumeSampler,pos+(float4)(-h,0,0,0))+
+	read_image(volume,volumeSampler,pos+(float4)(2.f*h,0,0,0))-
+  	read_image(volume,volumeSampler,pos+(float4)(-2.f*h,0,0,0));
+
+  normal.y = 2.f*read_image(volume,volumeSampler,pos+(float4)(0,h,0,0))-
+  	2.f*read_image(volume,volumeSampler,pos+(float4)(0,-h,0,0))+
+	read_image(volume,volumeSampler,pos+(float4)(0,2.f*h,0,0))-
+  	read_image(volume,volumeSampler,pos+(float4)(0,-2.f*h,0,0));
+
+  normal.z = read_image(volume,volumeSampler,pos+(float4)(0,0,h,0))-
+  	read_image(volume,volumeSampler,pos+(float4)(0,0,-h,0))+
+	read_image(volume,volumeSampler,pos+(float4)(0,0,2.f*h,0))-
+  	read_image(volume,volumeSampler,pos+(float4)(0,0,-2.f*h,0));
 
   normal.w = 0;
 
@@ -72,6 +72,17 @@ inline float4 mult(__QUALIFIER_CONSTANT float* M, float4 v){
 
 
 
-#define read_image(volume,sampler, pos,isShortType) (isShortType?1.f*read_imageui(volume, sampler, pos).x:read_imagef(volume, sampler, pos).x)
+// IS_SHORTTYPE is baked in at build time (see VolumeRenderer._get_program),
+// so the integer/float sampling decision is resolved by the compiler
+// instead of branching at every sample
+#ifndef IS_SHORTTYPE
+#define IS_SHORTTYPE 0
+#endif
+
+#if IS_SHORTTYPE
+#define read_image(volume,sampler, pos) (1.f*read_imageui(volume, sampler, pos).x)
+#else
+#define read_image(volume,sampler, pos) (read_imagef(volume, sampler, pos).x)
+#endif
 
 #endif
@@ -22,23 +22,29 @@ max_project_float(__global float *d_output,
                   __global float *d_alpha_output,
                   __global float *d_depth_output,
                   uint Nx, uint Ny,
-                  float boxMin_x,
-                  float boxMax_x,
-                  float boxMin_y,
-                  float boxMax_y,
-                  float boxMin_z,
-                  float boxMax_z,
-                  float minVal,
-                  float maxVal,
-                  float gamma,
-                  float alpha_pow,
+                  __QUALIFIER_CONSTANT float* params,
                   int numParts,
                   int currentPart,
+                  __QUALIFIER_CONSTANT float* jitterLUT,
                   __QUALIFIER_CONSTANT float* invP,
                   __QUALIFIER_CONSTANT float* invM,
                   __read_only image3d_t volume
 				 )
 {
+  // unpack the packed render parameter block (see VolumeRenderer)
+  const float boxMin_x = params[0];
+  const float boxMax_x = params[1];
+  const float boxMin_y = params[2];
+  const float boxMax_y = params[3];
+  const float boxMin_z = params[4];
+  const float boxMax_z = params[5];
+  const float minVal = params[6];
+  const float maxVal = params[7];
+  const float gamma = params[8];
+  const float alpha_pow = params[9];
+  const float earlyTermThresh = params[10];
+  const float jitterStrength = params[11];
+
   const sampler_t volumeSampler =   CLK_NORMALIZED_COORDS_TRUE |
 	CLK_ADDRESS_CLAMP_TO_EDGE | SAMPLER_FILTER;
 
@@ -83,7 +89,9 @@ max_project_float(__global float *d_output,
 
 
   if (!hit) {
-  	if ((x < Nx) && (y < Ny)) {
+  	// in accumulate mode (currentPart<0) a missed box must not
+  	// erase the content of earlier volumes
+  	if ((currentPart >= 0) && (x < Nx) && (y < Ny)) {
   	  d_output[x+Nx*y] = 0.f;
 	  d_alpha_output[x+Nx*y] = -1.f;
   	}
@@ -103,7 +111,9 @@ max_project_float(__global float *d_output,
 
   //apply the shift if mulitpass
 
-  orig += currentPart*dt*direc;
+  // currentPart<0 accumulates into the output without shifting the
+  // ray start (used for batched multi volume rendering)
+  orig += max(currentPart,0)*dt*direc;
 
   //  dither the original
   // uint entropy = (uint)( 6779514*length(orig) + 6257327*length(direc) );
@@ -112,6 +122,10 @@ max_project_float(__global float *d_output,
   float4 delta_pos = .5f*dt*direc;
   float4 pos = 0.5f *(1.f + orig + tnear*direc);
 
+  // sub-step jitter of the ray start (16x16 Bayer pattern) - breaks up
+  // the wood grain banding of constant-step sampling
+  pos += jitterStrength*jitterLUT[(x&15)+16*(y&15)]*delta_pos;
+
   float newVal = 0.f;
 
   int maxInd = 0;
@@ -128,6 +142,12 @@ max_project_float(__global float *d_output,
   		// colVal = fmax(colVal,read_imagef(volume, volumeSampler, pos).x);
 		pos += delta_pos;
   	  }
+
+  	  // early ray termination: once the running max reached the
+  	  // termination threshold no later sample can change the result
+  	  if ((earlyTermThresh>0.f) && (maxVal>0.f) &&
+  		  (colVal >= minVal+earlyTermThresh*(maxVal-minVal)))
+  		break;
   	}
   	colVal = (maxVal == 0)?colVal:(colVal-minVal)/(maxVal-minVal);
   	alphaVal = colVal;
@@ -193,24 +213,30 @@ max_project_short(__global float *d_output,
                   __global float *d_depth_output,
                   uint Nx,
                   uint Ny,
-                  float boxMin_x,
-                  float boxMax_x,
-                  float boxMin_y,
-                  float boxMax_y,
-                  float boxMin_z,
-                  float boxMax_z,
-                  float minVal,
-                  float maxVal,
-                  float gamma,
-                  float alpha_pow,
+                  __QUALIFIER_CONSTANT float* params,
                   int numParts,
                   int currentPart,
+                  __QUALIFIER_CONSTANT float* jitterLUT,
                   __QUALIFIER_CONSTANT float* invP,
                   __QUALIFIER_CONSTANT float* invM,
                   __read_only image3d_t volume
                   )
 
 {
+  // unpack the packed render parameter block (see VolumeRenderer)
+  const float boxMin_x = params[0];
+  const float boxMax_x = params[1];
+  const float boxMin_y = params[2];
+  const float boxMax_y = params[3];
+  const float boxMin_z = params[4];
+  const float boxMax_z = params[5];
+  const float minVal = params[6];
+  const float maxVal = params[7];
+  const float gamma = params[8];
+  const float alpha_pow = params[9];
+  const float earlyTermThresh = params[10];
+  const float jitterStrength = params[11];
+
 
   const sampler_t volumeSampler =   CLK_NORMALIZED_COORDS_TRUE |
 	CLK_ADDRESS_CLAMP_TO_EDGE | SAMPLER_FILTER;
@@ -256,7 +282,9 @@ max_project_short(__global float *d_output,
 
 
   if (!hit) {
-  	if ((x < Nx) && (y < Ny)) {
+  	// in accumulate mode (currentPart<0) a missed box must not
+  	// erase the content of earlier volumes
+  	if ((currentPart >= 0) && (x < Nx) && (y < Ny)) {
   	  d_output[x+Nx*y] = 0.f;
 	  d_alpha_output[x+Nx*y] = 0.f;
   	}
@@ -276,7 +304,9 @@ max_project_short(__global float *d_output,
 
   //apply the shift if mulitpass
 
-  orig += currentPart*dt*direc;
+  // currentPart<0 accumulates into the output without shifting the
+  // ray start (used for batched multi volume rendering)
+  orig += max(currentPart,0)*dt*direc;
 
   //  dither the original
   // uint entropy = (uint)( 6779514*length(orig) + 6257327*length(direc) );
@@ -285,6 +315,10 @@ max_project_short(__global float *d_output,
   float4 delta_pos = .5f*dt*direc;
   float4 pos = 0.5f *(1.f + orig + tnear*direc);
 
+  // sub-step jitter of the ray start (16x16 Bayer pattern) - breaks up
+  // the wood grain banding of constant-step sampling
+  pos += jitterStrength*jitterLUT[(x&15)+16*(y&15)]*delta_pos;
+
   float newVal = 0.f;
 
 
@@ -295,6 +329,12 @@ max_project_short(__global float *d_output,
   		colVal = fmax(colVal,1.f*read_imageui(volume, volumeSampler, pos).x);
 		pos += delta_pos;
   	  }
+
+  	  // early ray termination: once the running max reached the
+  	  // termination threshold no later sample can change the result
+  	  if ((earlyTermThresh>0.f) && (maxVal>0.f) &&
+  		  (colVal >= minVal+earlyTermThresh*(maxVal-minVal)))
+  		break;
   	}
   	colVal = (maxVal == 0)?colVal:(colVal-minVal)/(maxVal-minVal);
   	alphaVal = colVal;
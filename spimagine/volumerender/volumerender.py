@@ -34,17 +34,25 @@ from six.moves import zip
 logger = logging.getLogger(__name__)
 
 import os
-# this is due to some pyinstaller bug!
-from scipy.integrate import *
 import numpy as np
-from scipy.linalg import inv
+import pyopencl as cl
 from time import time
 import sys
 from gputools import init_device, get_device, OCLProgram, OCLArray, OCLImage
+from spimagine.volumerender._render_prep import inv4x4
 from spimagine.utils.transform_matrices import *
 import spimagine
 
 
+def _bayer_pattern(n=4):
+    """the 2**n x 2**n Bayer dither matrix, normalized to [0,1)"""
+    b = np.zeros((1, 1), dtype=np.float32)
+    for _ in range(n):
+        b = np.vstack((np.hstack((4*b, 4*b+2)),
+                       np.hstack((4*b+3, 4*b+1))))
+    return b/b.size
+
+
 def absPath(myPath):
     """ Get absolute path to resource, works for dev and for PyInstaller """
     try:
@@ -69,8 +77,29 @@ class VolumeRenderer:
     interpolation_defines = {"linear": ["-D", "SAMPLER_FILTER=CLK_FILTER_LINEAR"],
                              "nearest": ["-D", "SAMPLER_FILTER=CLK_FILTER_NEAREST"]}
 
-    def __init__(self, size=None, interpolation='linear'):
-        """ e.g. size = (300,300)"""
+    # resolution reduction factors of the render quality levels - the
+    # "interactive" level is meant for frames during user interaction
+    # (dragging), where the full resolution result is not perceived anyway
+    quality_factors = {"final": 1, "interactive": 4}
+
+    # ray casting tolerates relaxed float semantics (no NaN/denormal
+    # handling needed) and profits from fused mul-adds in the sampling
+    # loop - set to False (and rebuild_program) for bitwise reproducible
+    # output, e.g. in tests
+    FAST_MATH = True
+    fast_math_options = ["-cl-finite-math-only",
+                         "-cl-fast-relaxed-math",
+                         "-cl-unsafe-math-optimizations",
+                         "-cl-mad-enable",
+                         "-cl-no-signed-zeros"]
+
+    def __init__(self, size=None, interpolation='linear', use_half=False):
+        """ e.g. size = (300,300)
+
+        use_half = True stores float32 volumes as a normalized half float
+        texture, halving the per-sample texture bandwidth of the (memory
+        bound) ray casting at the cost of ~3 decimal digits of precision
+        """
 
         try:
             # simulate GPU fail...
@@ -105,9 +134,65 @@ class VolumeRenderer:
 
         self.rebuild_program(interpolation = interpolation)
 
-        self.invMBuf = OCLArray.empty(16, dtype=np.float32)
-
-        self.invPBuf = OCLArray.empty(16, dtype=np.float32)
+        # host staging arrays plus reusable (ALLOC_HOST_PTR) device buffers
+        # for the two inverse matrices - the upload is tiny but happens every
+        # frame during interaction, so we avoid per frame allocations. The
+        # uploads themselves are blocking: the staging arrays get rewritten
+        # between passes (wait=False rendering, batched rendering), which a
+        # still pending non blocking copy sourcing from them would race
+        self._invM_host = np.empty(16, dtype=np.float32)
+        self._invP_host = np.empty(16, dtype=np.float32)
+
+        mf = cl.mem_flags
+        self.invMBuf = cl.Buffer(get_device().context,
+                                 mf.READ_ONLY | mf.ALLOC_HOST_PTR,
+                                 size=self._invM_host.nbytes)
+        self.invPBuf = cl.Buffer(get_device().context,
+                                 mf.READ_ONLY | mf.ALLOC_HOST_PTR,
+                                 size=self._invP_host.nbytes)
+
+        # the float render parameters (box bounds, min/max, gamma, ...) are
+        # packed into a single small constant buffer instead of being
+        # marshalled as a dozen individual kernel arguments
+        self._render_params_host = np.zeros(16, dtype=np.float32)
+        self._render_params_key = None
+        self.renderParamsBuf = cl.Buffer(get_device().context,
+                                         mf.READ_ONLY | mf.ALLOC_HOST_PTR,
+                                         size=self._render_params_host.nbytes)
+
+        # cache keys of the last uploaded inverse matrices such that
+        # update_matrices() only recomputes/uploads what actually changed
+        # (during interactive rotation e.g. the projection stays constant)
+        self._last_invM_key = None
+        self._last_invP_key = None
+
+        # cached inverse of the bare modelView (without the stack scale), so
+        # changing units/shape does not redo the 4x4 inversion
+        self._last_modelView_key = None
+        self._invMV = np.empty((4, 4), dtype=np.float32)
+
+        # staging array reused by update_data when downsampling
+        self._stage = None
+
+        # intensity offset/scale of the texture relative to the original
+        # data, only != (0,1) in the half float texture mode
+        self.use_half = use_half
+        self._tex_offset_scale = (0., 1.)
+
+        # per-ray sub-step start offsets (ordered dither), see set_jitter_strength
+        self._jitterBuf = OCLArray.from_array(
+            _bayer_pattern().ravel().astype(np.float32))
+
+        # boxed numpy scalars reused as kernel arguments, see _boxed
+        self._scalar_cache = {}
+
+        # pending events of the async device->host output copies
+        self._readback_events = []
+
+        # separate queue for the output transfers - with the copies fenced
+        # on the compute queue via an event, the PCIe readback of frame N
+        # can overlap the kernel of frame N+1 on the default queue
+        self._xfer_queue = cl.CommandQueue(get_device().context)
 
         self.projection = np.zeros((4, 4))
         self.modelView = np.zeros((4, 4))
@@ -127,6 +212,8 @@ class VolumeRenderer:
         self.set_occ_n_points(30)
 
         self.set_alpha_pow()
+        self.set_early_term_thresh()
+        self.set_jitter_strength()
         self.set_box_boundaries()
         self.set_units()
 
@@ -135,6 +222,12 @@ class VolumeRenderer:
 
 
     def rebuild_program(self, interpolation = "linear"):
+        # bound kernel objects of the current program, see _get_kernel
+        self._kernels = {}
+        # specialized program variants, keyed on their extra defines and
+        # compiled lazily in _get_program
+        self._programs = {}
+
         build_options_basic = ["-I", "%s" % absPath("kernels/"),
                                "-D", "maxSteps=%s" % spimagine.config.__DEFAULTMAXSTEPS__,
 
@@ -149,20 +242,51 @@ class VolumeRenderer:
             raise KeyError(
                 "interpolation = '%s' not defined ,valid: %s" % (interpolation, list(VolumeRenderer.interpolation_defines.keys())))
 
-        try:
-            self.proc = OCLProgram(absPath("kernels/all_render_kernels.cl"),
-                               build_options=
-                               build_options_basic+
-                               ["-cl-finite-math-only",
-                                "-cl-fast-relaxed-math",
-                                "-cl-unsafe-math-optimizations",
-                                "-cl-mad-enable"])
-        except Exception as e:
-            logger.debug(str(e))
-            self.proc = OCLProgram(absPath("kernels/all_render_kernels.cl"),
-                                   build_options=
-                                   build_options_basic)
-        self.proc
+        self._build_options_basic = build_options_basic
+        self.proc = self._build_program()
+
+    def _build_program(self, extra_defines=()):
+        build_options = self._build_options_basic+list(extra_defines)
+
+        if self.FAST_MATH:
+            try:
+                return OCLProgram(absPath("kernels/all_render_kernels.cl"),
+                                  build_options=
+                                  build_options+
+                                  self.fast_math_options)
+            except Exception as e:
+                logger.debug(str(e))
+
+        return OCLProgram(absPath("kernels/all_render_kernels.cl"),
+                          build_options=
+                          build_options)
+
+    def _get_program(self, extra_defines=()):
+        """program variant compiled with the given extra defines, e.g.
+        ("-D","IS_SHORTTYPE=1") - baking such per-dtype flags in at build
+        time lets the compiler drop the corresponding per-sample branches.
+        Variants are compiled on first use and cached until the next
+        rebuild_program"""
+        key = tuple(extra_defines)
+        if key not in self._programs:
+            self._programs[key] = self._build_program(extra_defines)
+        return self._programs[key]
+
+    def _get_kernel(self, name):
+        """fetch and cache the bound kernel object - a fresh pyopencl.Kernel
+        gets created on every program attribute access otherwise"""
+        if name not in self._kernels:
+            self._kernels[name] = getattr(self.proc, name)
+        return self._kernels[name]
+
+    def _boxed(self, key, value, dtype):
+        """cache the numpy scalar wrappers passed as kernel arguments, so
+        values that did not change between frames are not re-boxed"""
+        cached = self._scalar_cache.get(key)
+        if cached is None or cached!=value:
+            cached = dtype(value)
+            self._scalar_cache[key] = cached
+        return cached
 
     def set_dtype(self, dtype=None):
         if hasattr(self, "dtype") and dtype is self.dtype:
@@ -192,24 +316,74 @@ class VolumeRenderer:
 
         self.buf_occlusion = OCLArray.empty((self.height, self.width), dtype=np.float32)
 
-        self.output = np.zeros((self.height, self.width), dtype=np.float32)
-        self.output_alpha = np.zeros((self.height, self.width), dtype=np.float32)
-        self.output_depth = np.zeros((self.height, self.width), dtype=np.float32)
-
-    def _get_downsampled_data_slices(self, data):
+        # double buffered rings of host output arrays, keyed on shape and
+        # rotated per frame in _next_output_arrays
+        self._out_rings = {}
+        self.output, self.output_alpha, self.output_depth = \
+            self._next_output_arrays((self.height, self.width))
+
+        # reduced resolution buffers, allocated lazily per factor
+        self._lo_bufs = {}
+
+    def _next_output_arrays(self, shape):
+        """rotate the ring of preallocated host output arrays of the given
+        shape - with asynchronous readbacks (render(wait = False)) the
+        triple handed out for the last frame stays untouched while the
+        next frame's copy lands in its sibling, and no per frame host
+        allocation happens either way"""
+        if shape not in self._out_rings:
+            self._out_rings[shape] = [0, [
+                tuple(np.zeros(shape, dtype=np.float32) for _ in range(3))
+                for _ in range(2)]]
+        ring = self._out_rings[shape]
+        ring[0] = 1-ring[0]
+        return ring[1][ring[0]]
+
+    def _low_res_buffers(self, factor):
+        """device buffer set for rendering at reduced resolution"""
+        if factor not in self._lo_bufs:
+            w = max(self.width//factor, 1)
+            h = max(self.height//factor, 1)
+            self._lo_bufs[factor] = (OCLArray.empty((h, w), dtype=np.float32),
+                                     OCLArray.empty((h, w), dtype=np.float32),
+                                     OCLArray.empty((h, w), dtype=np.float32))
+        return self._lo_bufs[factor]
+
+    def _get_downsample_step(self, data):
         """in case data is bigger then gpu texture memory, we should downsample it
-        if so returns the slice of data to be rendered
-        else returns None (no downsampling)
+        returns the downsample factor along every axis (1 = no downsampling)
         """
         # Nstep = int(np.ceil(np.sqrt(1.*data.nbytes/self.memMax)))
         Nstep = int(np.ceil((1.*data.nbytes/self.memMax)**(1./3)))
 
-        slices = [slice(0, d, Nstep) for d in data.shape]
         if Nstep>1:
             logger.info("downsample image by factor of  %s"%Nstep)
-            return slices
+        return Nstep
+
+    def _block_average(self, data, Nstep, out=None):
+        """mipmap style block-mean downsample of data by a factor Nstep along
+        every axis - in contrast to taking every Nstep-th voxel this uses the
+        full signal and does not alias
+        """
+        # clamp the step per axis so dimensions smaller than the downsample
+        # factor (thin stacks) keep one voxel instead of vanishing
+        steps = tuple(min(Nstep, d) for d in data.shape)
+        sh = tuple(d//s for d, s in zip(data.shape, steps))
+        blocks = data[:sh[0]*steps[0], :sh[1]*steps[1], :sh[2]*steps[2]].reshape(
+            sh[0], steps[0], sh[1], steps[1], sh[2], steps[2])
+
+        if out is None or out.shape!=sh or out.dtype!=self.dtype:
+            out = np.empty(sh, dtype=self.dtype)
+
+        if np.issubdtype(np.dtype(self.dtype), np.integer):
+            # accumulate in a wide integer type to avoid overflow
+            np.floor_divide(blocks.sum(axis=(1, 3, 5), dtype=np.uint32),
+                            steps[0]*steps[1]*steps[2], out=out,
+                            casting="unsafe")
         else:
-            return None
+            np.copyto(out, blocks.mean(axis=(1, 3, 5), dtype=np.float32),
+                      casting="unsafe")
+        return out
 
     def set_max_val(self, maxVal=0.):
         self.maxVal = maxVal
@@ -232,6 +406,16 @@ class VolumeRenderer:
     def set_alpha_pow(self, alphaPow=0.):
         self.alphaPow = alphaPow
 
+    def set_early_term_thresh(self, earlyTermThresh=0.):
+        """relative intensity (in units of maxVal-minVal) at which rays may
+        terminate early during max projection, 0 = disabled"""
+        self.earlyTermThresh = earlyTermThresh
+
+    def set_jitter_strength(self, jitterStrength=1.):
+        """scale of the per-ray sub-step start offset (Bayer pattern) that
+        suppresses wood grain banding, 0 = disabled"""
+        self.jitterStrength = jitterStrength
+
     def set_data(self, data, autoConvert=True, copyData=False):
         logger.debug("set_data")
 
@@ -245,10 +429,11 @@ class VolumeRenderer:
             print("converting type from %s to %s"%(data.dtype.type, self.dtype))
             _data = data.astype(self.dtype, copy=False)
 
-        self.dataSlices = self._get_downsampled_data_slices(_data)
+        self.dataStep = self._get_downsample_step(_data)
 
-        if self.dataSlices is not None:
-            self.set_shape(_data[self.dataSlices].shape[::-1])
+        if self.dataStep>1:
+            self.set_shape(tuple(max(d//self.dataStep, 1)
+                                 for d in _data.shape)[::-1])
         else:
             self.set_shape(_data.shape[::-1])
 
@@ -258,8 +443,13 @@ class VolumeRenderer:
         self.update_matrices()
 
     def set_shape(self, dataShape):
+        if self.use_half and self.dtype==np.float32:
+            texture_dtype = np.float16
+        else:
+            texture_dtype = self.dtype
+
         if self.isGPU:
-            self.dataImg = OCLImage.empty(dataShape[::-1], dtype=self.dtype)
+            self.dataImg = OCLImage.empty(dataShape[::-1], dtype=texture_dtype)
         else:
             raise NotImplementedError("TODO")
             # self.dataImg = self.dev.createImage(dataShape,
@@ -280,18 +470,38 @@ class VolumeRenderer:
     def update_data(self, data, copyData=False):
         # do we really want to copy here?
 
-        if self.dataSlices is not None:
-            self._data = data[self.dataSlices].copy()
+        if self.dataStep>1:
+            # block average into a preallocated staging array - repeated
+            # set_data calls (e.g. browsing a timelapse) then reuse the same
+            # host memory instead of reallocating the downsampled cube
+            self._stage = self._block_average(data, self.dataStep,
+                                              out=self._stage)
+            self._data = self._stage
         else:
             if copyData:
                 self._data = data.copy()
             else:
                 self._data = data
 
-        if self._data.dtype!=self.dtype:
-            self._data = self._data.astype(self.dtype, copy=False)
-
-        self.dataImg.write_array(self._data)
+            # callers like the timepoint slider pass raw stacks directly, so
+            # the coercion to the texture dtype has to happen here as well
+            # (the block average path above already casts)
+            if self._data.dtype!=self.dtype:
+                self._data = self._data.astype(self.dtype, copy=False)
+
+        if self.use_half and self.dtype==np.float32:
+            # normalize to [0,1] and store as half float - min/max are kept
+            # so intensity parameters can be mapped into texture units
+            mi = 1.*self._data.min()
+            scale = 1.*self._data.max()-mi
+            if scale==0.:
+                scale = 1.
+            self._tex_offset_scale = (mi, scale)
+            self.dataImg.write_array(
+                ((self._data-mi)*(1./scale)).astype(np.float16))
+        else:
+            self._tex_offset_scale = (0., 1.)
+            self.dataImg.write_array(self._data)
 
     def set_box_boundaries(self, boxBounds=[-1, 1, -1, 1, -1, 1]):
         self.boxBounds = np.array(boxBounds)
@@ -304,27 +514,125 @@ class VolumeRenderer:
         self.update_matrices()
 
     def set_modelView(self, modelView=mat4_identity()):
-        self.modelView = 1.*modelView
+        # no copy/cast when the matrix already is float32 (the precision the
+        # kernel consumes anyway)
+        self.modelView = np.asarray(modelView, dtype=np.float32)
         self.update_matrices()
 
     def update_matrices(self):
         if hasattr(self, "dataImg"):
-            mScale = self._stack_scale_mat()
-            invM = inv(np.dot(self.modelView, mScale))
-            self.invMBuf.write_array(invM.flatten().astype(np.float32))
-            invP = inv(self.projection)
-            self.invPBuf.write_array(invP.flatten().astype(np.float32))
-
-    def _stack_scale_mat(self):
+            mKey = (self.modelView.tobytes(),
+                    self.stackUnits.tobytes(),
+                    self.dataImg.shape)
+            if mKey != self._last_invM_key:
+                if mKey[0] != self._last_modelView_key:
+                    inv4x4(np.ascontiguousarray(self.modelView,
+                                                dtype=np.float32),
+                           self._invMV)
+                    self._last_modelView_key = mKey[0]
+
+                # the stack scale matrix is diagonal, so
+                # inv(modelView.mScale) is just inv(modelView) with the
+                # first three rows divided by the scale factors - no second
+                # matmul and no second 4x4 inversion needed
+                sx, sy, sz = self._stack_scale_factors()
+                invM = self._invM_host.reshape(4, 4)
+                invM[0] = self._invMV[0]/sx
+                invM[1] = self._invMV[1]/sy
+                invM[2] = self._invMV[2]/sz
+                invM[3] = self._invMV[3]
+                cl.enqueue_copy(get_device().queue, self.invMBuf,
+                                self._invM_host, is_blocking=True)
+                self._last_invM_key = mKey
+
+            pKey = self.projection.tobytes()
+            if pKey != self._last_invP_key:
+                inv4x4(np.ascontiguousarray(self.projection,
+                                            dtype=np.float32),
+                       self._invP_host.reshape(4, 4))
+                cl.enqueue_copy(get_device().queue, self.invPBuf,
+                                self._invP_host, is_blocking=True)
+                self._last_invP_key = pKey
+
+    def _stack_scale_factors(self):
         # scaling the data according to size and units
         Nx, Ny, Nz = self.dataImg.shape
         dx, dy, dz = self.stackUnits
 
         # mScale =  scaleMat(1.,1.*dx*Nx/dy/Ny,1.*dx*Nx/dz/Nz)
         maxDim = max(d*N for d, N in zip([dx, dy, dz], [Nx, Ny, Nz]))
-        return mat4_scale(1.*dx*Nx/maxDim, 1.*dy*Ny/maxDim, 1.*dz*Nz/maxDim)
+        return 1.*dx*Nx/maxDim, 1.*dy*Ny/maxDim, 1.*dz*Nz/maxDim
+
+    def _stack_scale_mat(self):
+        return mat4_scale(*self._stack_scale_factors())
+
+    def sync(self):
+        """wait until all pending output readbacks have finished"""
+        for ev in self._readback_events:
+            ev.wait()
+        self._readback_events = []
+
+    def _tex_norm(self, v):
+        """map an intensity value into texture units (identity unless the
+        half float texture mode rescaled the data)"""
+        offset, scale = self._tex_offset_scale
+        return (v-offset)/scale
+
+    def _update_render_params(self):
+        """upload the packed float parameter block consumed by the max
+        projection kernels, skipping the transfer when nothing changed"""
+        if self.maxVal==0:
+            # maxVal==0 makes the kernel skip normalization altogether
+            minVal, maxVal = self.minVal, 0.
+        else:
+            minVal, maxVal = self._tex_norm(self.minVal), self._tex_norm(self.maxVal)
+
+        vals = (self.boxBounds[0], self.boxBounds[1],
+                self.boxBounds[2], self.boxBounds[3],
+                self.boxBounds[4], self.boxBounds[5],
+                minVal, maxVal,
+                self.gamma, self.alphaPow,
+                self.earlyTermThresh, self.jitterStrength)
+
+        if vals!=self._render_params_key:
+            self._render_params_host[:len(vals)] = vals
+            cl.enqueue_copy(get_device().queue, self.renderParamsBuf,
+                            self._render_params_host, is_blocking=True)
+            self._render_params_key = vals
+
+    def _compute_render_rect(self, width, height):
+        """project the 8 corners of the bounding box to pixel space and
+        return the enclosing rectangle (x0, y0, w, h) clamped to the
+        given viewport - returns None when the full viewport has to be
+        rendered (box covering the frame or corners behind the camera)
+        """
+        xs, ys, zs = self.boxBounds[:2], self.boxBounds[2:4], self.boxBounds[4:6]
+        corners = np.array([(x, y, z, 1.) for x in xs for y in ys for z in zs])
+
+        M = np.dot(self.projection,
+                   np.dot(self.modelView, self._stack_scale_mat()))
+        p = np.dot(corners, M.T)
+
+        pw = p[:, 3]
+        if np.any(pw<=1.e-6):
+            return None
 
-    def _render_max_project(self, dtype=np.float32, numParts=1, currentPart=0):
+        u = p[:, 0]/pw
+        v = p[:, 1]/pw
+
+        # one pixel of padding against rounding of the corner projections
+        x0 = max(int(np.floor((np.amin(u)+1.)/2.*width))-1, 0)
+        x1 = min(int(np.ceil((np.amax(u)+1.)/2.*width))+1, width)
+        y0 = max(int(np.floor((np.amin(v)+1.)/2.*height))-1, 0)
+        y1 = min(int(np.ceil((np.amax(v)+1.)/2.*height))+1, height)
+
+        if x0==0 and y0==0 and x1==width and y1==height:
+            return None
+
+        return x0, y0, max(x1-x0, 0), max(y1-y0, 0)
+
+    def _render_max_project(self, dtype=np.float32, numParts=1, currentPart=0,
+                            downsample=1, readback=True):
         if dtype in [np.uint16, np.uint8]:
             method = "max_project_short"
         elif dtype==np.float32:
@@ -348,7 +656,7 @@ class VolumeRenderer:
         # """
         # prog = OCLProgram(src_str=src_str)
         #
-        # prog.run_kernel("foo", self.invMBuf.shape, None, self.invMBuf.data, out.data)
+        # prog.run_kernel("foo", self.invMBuf.shape, None, self.invMBuf, out.data)
         # print(out.get())
         # method = "foo"
         #
@@ -363,31 +671,80 @@ class VolumeRenderer:
 
 
 
-        self.proc.run_kernel(method,
-                             (self.width, self.height),
-                             None,
-                             self.buf.data, self.buf_alpha.data,
-                             self.buf_depth.data,
-                             np.int32(self.width), np.int32(self.height),
-                             np.float32(self.boxBounds[0]),
-                             np.float32(self.boxBounds[1]),
-                             np.float32(self.boxBounds[2]),
-                             np.float32(self.boxBounds[3]),
-                             np.float32(self.boxBounds[4]),
-                             np.float32(self.boxBounds[5]),
-                             np.float32(self.minVal),
-                             np.float32(self.maxVal),
-                             np.float32(self.gamma),
-                             np.float32(self.alphaPow),
-                             np.int32(numParts),
-                               np.int32(currentPart),
-                             self.invPBuf.data,
-                             self.invMBuf.data,
-                             self.dataImg)
+        self._update_render_params()
 
-        self.output = self.buf.get()
-        self.output_alpha = self.buf_alpha.get()
-        self.output_depth = self.buf_depth.get()
+        if downsample>1:
+            buf, buf_alpha, buf_depth = self._low_res_buffers(downsample)
+            height, width = buf.shape
+        else:
+            buf, buf_alpha, buf_depth = self.buf, self.buf_alpha, self.buf_depth
+            width, height = self.width, self.height
+
+        # the device output buffers are a single set (the host array ring
+        # only protects the host side), so this frame's clears and kernel
+        # must be ordered behind a still pending readback of the previous
+        # frame (render(wait=False)) before overwriting them
+        wait_for = self._readback_events if self._readback_events else None
+
+        rect = self._compute_render_rect(width, height)
+        if rect is None:
+            global_offset = None
+            global_size = (width, height)
+        else:
+            # the volume covers only part of the frame - clear the outputs
+            # once and launch work items over the bounding rectangle only
+            x0, y0, w, h = rect
+            global_offset = (x0, y0)
+            global_size = (w, h)
+            if currentPart==0:
+                buf.fill(np.float32(0), wait_for=wait_for)
+                buf_alpha.fill(
+                    np.float32(-1. if dtype==np.float32 else 0.),
+                    wait_for=wait_for)
+
+        if global_size[0]>0 and global_size[1]>0:
+            kernel = self._get_kernel(method)
+
+            kernel(get_device().queue,
+                   global_size,
+                   None,
+                   buf.data, buf_alpha.data,
+                   buf_depth.data,
+                   self._boxed("width", width, np.int32),
+                   self._boxed("height", height, np.int32),
+                   self.renderParamsBuf,
+                   self._boxed("numParts", numParts, np.int32),
+                   self._boxed("currentPart", currentPart, np.int32),
+                   self._jitterBuf.data,
+                   self.invPBuf,
+                   self.invMBuf,
+                   self.dataImg,
+                   global_offset=global_offset,
+                   wait_for=wait_for)
+
+        if not readback:
+            # intermediate pass of a batched render - the output stays on
+            # the device for the next accumulation pass
+            return
+
+        # non blocking readback into the next host array set of the ring
+        # on the transfer queue - the marker fences the copies behind the
+        # kernel (and any buffer clears) of the compute queue, and the
+        # caller (render) decides whether to wait
+        output, output_alpha, output_depth = \
+            self._next_output_arrays((height, width))
+        fence = cl.enqueue_marker(get_device().queue)
+        self._readback_events = [
+            cl.enqueue_copy(self._xfer_queue, output, buf.data,
+                            wait_for=[fence], is_blocking=False),
+            cl.enqueue_copy(self._xfer_queue, output_alpha, buf_alpha.data,
+                            wait_for=[fence], is_blocking=False),
+            cl.enqueue_copy(self._xfer_queue, output_depth, buf_depth.data,
+                            wait_for=[fence], is_blocking=False)]
+
+        self.output = output
+        self.output_alpha = output_alpha
+        self.output_depth = output_depth
 
     def _convolve_scalar(self, buf, radius=11):
 
@@ -415,8 +772,14 @@ class VolumeRenderer:
                              buf.data,
                              np.int32(radius))
 
+    def _iso_program(self):
+        """iso_surface program specialized on the volume dtype (the
+        short/float sampling choice is a compile time define)"""
+        return self._get_program(
+            ("-D", "IS_SHORTTYPE=%d" % (self.dtype in [np.uint16, np.uint8])))
+
     def _render_isosurface2(self):
-        self.proc.run_kernel("iso_surface",
+        self._iso_program().run_kernel("iso_surface",
                              (self.width, self.height),
                              None,
                              self.buf.data, self.buf_alpha.data,
@@ -428,12 +791,11 @@ class VolumeRenderer:
                              np.float32(self.boxBounds[3]),
                              np.float32(self.boxBounds[4]),
                              np.float32(self.boxBounds[5]),
-                             np.float32(self.maxVal/2),
+                             np.float32(self._tex_norm(self.maxVal/2)),
                              np.float32(self.gamma),
-                             self.invPBuf.data,
-                             self.invMBuf.data,
-                             self.dataImg,
-                             np.int32(self.dtype in [np.uint16, np.uint8])
+                             self.invPBuf,
+                             self.invMBuf,
+                             self.dataImg
                              )
 
         self._convolve_vec(self.buf_normals, 5)
@@ -448,7 +810,7 @@ class VolumeRenderer:
         with ambient occlusion
         """
 
-        self.proc.run_kernel("iso_surface",
+        self._iso_program().run_kernel("iso_surface",
                              (self.width, self.height),
                              None,
                              self.buf.data, self.buf_alpha.data,
@@ -460,12 +822,11 @@ class VolumeRenderer:
                              np.float32(self.boxBounds[3]),
                              np.float32(self.boxBounds[4]),
                              np.float32(self.boxBounds[5]),
-                             np.float32(self.maxVal/2),
+                             np.float32(self._tex_norm(self.maxVal/2)),
                              np.float32(self.gamma),
-                             self.invPBuf.data,
-                             self.invMBuf.data,
-                             self.dataImg,
-                             np.int32(self.dtype in [np.uint16, np.uint8])
+                             self.invPBuf,
+                             self.invMBuf,
+                             self.dataImg
                              )
         self._convolve_vec(self.buf_normals, 7)
         #
@@ -487,8 +848,8 @@ class VolumeRenderer:
                              None,
                              self.buf.data, self.buf_alpha.data,
                              np.int32(self.width), np.int32(self.height),
-                             self.invPBuf.data,
-                             self.invMBuf.data,
+                             self.invPBuf,
+                             self.invMBuf,
                              np.float32(self.occ_strength),
                              self.buf_normals.data,
                              self.buf_depth.data,
@@ -509,7 +870,7 @@ class VolumeRenderer:
                minVal=None, maxVal=None, gamma=None,
                modelView=None, projection=None,
                boxBounds=None, return_alpha=False, method="max_project",
-               numParts=1, currentPart=0):
+               numParts=1, currentPart=0, wait=True, quality="final"):
 
         if data is not None:
             self.set_data(data)
@@ -541,8 +902,120 @@ class VolumeRenderer:
             return
 
         if method=="max_project":
-            self._render_max_project(self.dtype, numParts, currentPart)
+            # quality "interactive" renders at reduced resolution (output
+            # then has the reduced shape and is meant to be stretched by the
+            # UI); an integer is accepted as an explicit reduction factor
+            downsample = self.quality_factors.get(quality, quality)
+            if not isinstance(downsample, int) or downsample<1:
+                raise KeyError("quality = '%s' not defined, valid: %s or an integer factor >= 1"
+                               % (quality, list(self.quality_factors.keys())))
+            self._render_max_project(self.dtype, numParts, currentPart,
+                                     downsample=downsample)
 
         if method=="iso_surface":
             self._render_isosurface()
 
+        # with wait=False the output readback is left in flight, so the GPU
+        # can already start on the next frame - call sync() (or the next
+        # render(wait=True)) before touching self.output
+        if wait:
+            self.sync()
+
+        return self.output
+
+
+
+class BatchedVolumeRenderer:
+    """ max projects several volumes (e.g. the channels of a multi channel
+    stack) into one shared output buffer
+
+    usage:
+               rend = BatchedVolumeRenderer((400,400))
+               rend.set_data([d1, d2])
+               out = rend.render(maxVal=1000.)
+
+    the per volume state is kept as lists (texture handles, intensity
+    offset/scale pairs) and the per volume passes accumulate their running
+    maximum on the device via the kernel's accumulate mode (currentPart<0),
+    so a whole batch costs a single readback instead of one per volume
+
+    with image arrays of 3d textures unavailable before OpenCL 2.0 the
+    passes still are separate kernel launches, but they share all setup,
+    parameter and output buffers
+    """
+
+    def __init__(self, size=None, **kwargs):
+        self.rend = VolumeRenderer(size, **kwargs)
+        self.dataImgs = []
+        self._tex_offset_scales = []
+        self.output = self.rend.output
+
+    def set_data(self, datas, autoConvert=True):
+        """datas = list of volumes of identical dtype (shapes may differ)"""
+        datas = list(datas)
+        if len(datas)==0:
+            raise ValueError("empty list of volumes")
+
+        self.dataImgs = []
+        self._tex_offset_scales = []
+        dtype = None
+        for data in datas:
+            self.rend.set_data(data, autoConvert=autoConvert)
+            # one kernel (chosen per dtype) renders all textures of the
+            # batch, so mixed dtypes cannot work
+            if dtype is None:
+                dtype = self.rend.dtype
+            elif self.rend.dtype!=dtype:
+                raise NotImplementedError(
+                    "volumes should all be of the same data type (%s not %s)"
+                    % (dtype, self.rend.dtype))
+            self.dataImgs.append(self.rend.dataImg)
+            self._tex_offset_scales.append(self.rend._tex_offset_scale)
+
+    def set_units(self, stackUnits=np.ones(3)):
+        self.rend.set_units(stackUnits)
+
+    def set_modelView(self, modelView=mat4_identity()):
+        self.rend.set_modelView(modelView)
+
+    def set_projection(self, projection=mat4_perspective()):
+        self.rend.set_projection(projection)
+
+    def render(self, minVal=None, maxVal=None, gamma=None,
+               modelView=None, projection=None, quality="final"):
+        if len(self.dataImgs)==0:
+            print("no data provided, set_data(datas) before")
+            return
+
+        if maxVal is not None:
+            self.rend.set_max_val(maxVal)
+        if minVal is not None:
+            self.rend.set_min_val(minVal)
+        if gamma is not None:
+            self.rend.set_gamma(gamma)
+        if modelView is not None:
+            self.rend.set_modelView(modelView)
+        if projection is not None:
+            self.rend.set_projection(projection)
+
+        downsample = VolumeRenderer.quality_factors.get(quality, quality)
+        if not isinstance(downsample, int) or downsample<1:
+            raise KeyError("quality = '%s' not defined, valid: %s or an integer factor >= 1"
+                           % (quality, list(VolumeRenderer.quality_factors.keys())))
+
+        last = len(self.dataImgs)-1
+        for i, dataImg in enumerate(self.dataImgs):
+            self.rend.dataImg = dataImg
+            self.rend._tex_offset_scale = self._tex_offset_scales[i]
+            # the invM cache key includes the texture shape, so volumes of
+            # different shape get their matrix refreshed automatically
+            self.rend.update_matrices()
+
+            self.rend._render_max_project(self.rend.dtype,
+                                          currentPart=0 if i==0 else -1,
+                                          downsample=downsample,
+                                          readback=(i==last))
+
+        self.rend.sync()
+        self.output = self.rend.output
+        return self.output
@@ -0,0 +1,279 @@
+"""
+CUDA (CuPy) backend for the max projection renderer
+
+on NVIDIA hardware the CUDA driver stack usually outruns its OpenCL
+counterpart for texture bound ray casting, so this module offers a drop-in
+CudaVolumeRenderer mirroring the max projection subset of the
+VolumeRenderer API (set_data/set_units/set_modelView/set_projection/
+render -> output). The volume lives in a CUDA array sampled through a
+texture object with hardware trilinear filtering.
+
+cupy is an optional dependency - importing this module without it raises
+an ImportError with a helpful message only when the class is instantiated
+
+usage:
+
+rend = CudaVolumeRenderer((400,400))
+rend.set_data(d)
+out = rend.render(maxVal = 1000.)
+"""
+
+from __future__ import absolute_import, print_function
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+import numpy as np
+from spimagine.volumerender._render_prep import inv4x4
+from spimagine.utils.transform_matrices import *
+import spimagine
+
+try:
+    import cupy as cp
+    from cupy.cuda import texture, runtime
+except ImportError:
+    cp = None
+
+
+_cuda_kernel_source = r"""
+#define maxSteps %(max_steps)d
+
+__device__ float4 mul4(const float* M, float4 v){
+    return make_float4(
+        M[0]*v.x+M[1]*v.y+M[2]*v.z+M[3]*v.w,
+        M[4]*v.x+M[5]*v.y+M[6]*v.z+M[7]*v.w,
+        M[8]*v.x+M[9]*v.y+M[10]*v.z+M[11]*v.w,
+        M[12]*v.x+M[13]*v.y+M[14]*v.z+M[15]*v.w);
+}
+
+__device__ int intersectBox(float4 r_o, float4 r_d,
+                            float4 boxmin, float4 boxmax,
+                            float *tnear, float *tfar){
+    float tbx = (boxmin.x-r_o.x)/r_d.x, ttx = (boxmax.x-r_o.x)/r_d.x;
+    float tby = (boxmin.y-r_o.y)/r_d.y, tty = (boxmax.y-r_o.y)/r_d.y;
+    float tbz = (boxmin.z-r_o.z)/r_d.z, ttz = (boxmax.z-r_o.z)/r_d.z;
+
+    float largest_tmin = fmaxf(fmaxf(fminf(tbx,ttx), fminf(tby,tty)),
+                               fminf(tbz,ttz));
+    float smallest_tmax = fminf(fminf(fmaxf(tbx,ttx), fmaxf(tby,tty)),
+                                fmaxf(tbz,ttz));
+    *tnear = largest_tmin;
+    *tfar = smallest_tmax;
+    return smallest_tmax > largest_tmin;
+}
+
+extern "C" __global__ void
+max_project(float *d_output, int Nx, int Ny,
+            const float *params,
+            const float *invP, const float *invM,
+            cudaTextureObject_t volume)
+{
+    int x = blockIdx.x*blockDim.x + threadIdx.x;
+    int y = blockIdx.y*blockDim.y + threadIdx.y;
+    if ((x >= Nx) || (y >= Ny))
+        return;
+
+    // same packed parameter layout as the OpenCL kernels
+    float4 boxMin = make_float4(params[0], params[2], params[4], 1.f);
+    float4 boxMax = make_float4(params[1], params[3], params[5], 1.f);
+    const float minVal = params[6];
+    const float maxVal = params[7];
+    const float gamma  = params[8];
+
+    float u = (x/(float)Nx)*2.f-1.f;
+    float v = (y/(float)Ny)*2.f-1.f;
+
+    // eye ray in model space
+    float4 orig0 = mul4(invP, make_float4(u, v, -1.f, 1.f));
+    orig0.x /= orig0.w; orig0.y /= orig0.w; orig0.z /= orig0.w; orig0.w = 1.f;
+
+    float4 orig = mul4(invM, orig0);
+    orig.x /= orig.w; orig.y /= orig.w; orig.z /= orig.w; orig.w = 1.f;
+
+    float4 temp = mul4(invP, make_float4(u, v, 1.f, 1.f));
+    temp.x /= temp.w; temp.y /= temp.w; temp.z /= temp.w;
+
+    float4 diff = make_float4(temp.x-orig0.x, temp.y-orig0.y,
+                              temp.z-orig0.z, 0.f);
+    float n = rsqrtf(diff.x*diff.x+diff.y*diff.y+diff.z*diff.z);
+    diff.x *= n; diff.y *= n; diff.z *= n;
+
+    float4 direc = mul4(invM, diff);
+    direc.w = 0.f;
+
+    float tnear, tfar;
+    int hit = intersectBox(orig, direc, boxMin, boxMax, &tnear, &tfar);
+    if (!hit){
+        d_output[x+Nx*y] = 0.f;
+        return;
+    }
+    if (tnear < 0.f)
+        tnear = 0.f;
+
+    const float dt = fabsf(tfar-tnear)/(maxSteps-1.f);
+
+    float px = .5f*(1.f+orig.x+tnear*direc.x);
+    float py = .5f*(1.f+orig.y+tnear*direc.y);
+    float pz = .5f*(1.f+orig.z+tnear*direc.z);
+    const float dx = .5f*dt*direc.x;
+    const float dy = .5f*dt*direc.y;
+    const float dz = .5f*dt*direc.z;
+
+    float colVal = 0.f;
+    for (int i = 0; i < maxSteps; ++i){
+        colVal = fmaxf(colVal, tex3D<float>(volume, px, py, pz));
+        px += dx; py += dy; pz += dz;
+    }
+
+    colVal = (maxVal == 0.f)?colVal:(colVal-minVal)/(maxVal-minVal);
+    d_output[x+Nx*y] = fminf(fmaxf(powf(colVal, gamma), 0.f), 1.f);
+}
+"""
+
+
+class CudaVolumeRenderer:
+    """ max projects a float32 volume via CUDA/CuPy
+
+    usage:
+               rend = CudaVolumeRenderer((400,400))
+               rend.set_data(d)
+               out = rend.render(maxVal = 1000.)
+    """
+
+    def __init__(self, size=None):
+        if cp is None:
+            raise ImportError(
+                "CudaVolumeRenderer requires cupy (pip install cupy)")
+
+        self.width, self.height = size if size else (200, 200)
+
+        self._kernel = cp.RawKernel(
+            _cuda_kernel_source
+            % {"max_steps": spimagine.config.__DEFAULTMAXSTEPS__},
+            "max_project")
+
+        self.buf = cp.zeros((self.height, self.width), dtype=np.float32)
+        self.output = np.zeros((self.height, self.width), dtype=np.float32)
+
+        self._params = cp.zeros(16, dtype=np.float32)
+        self._invM_host = np.empty(16, dtype=np.float32)
+        self._invP_host = np.empty(16, dtype=np.float32)
+        self.invMBuf = cp.zeros(16, dtype=np.float32)
+        self.invPBuf = cp.zeros(16, dtype=np.float32)
+
+        self._tex = None
+        self._cuda_array = None
+        self.dataShape = None
+
+        self.set_gamma()
+        self.set_max_val()
+        self.set_min_val()
+        self.set_box_boundaries()
+        self.set_units()
+        self.set_modelView()
+        self.set_projection()
+
+    def set_max_val(self, maxVal=0.):
+        self.maxVal = maxVal
+
+    def set_min_val(self, minVal=0.):
+        self.minVal = minVal
+
+    def set_gamma(self, gamma=1.):
+        self.gamma = gamma
+
+    def set_box_boundaries(self, boxBounds=[-1, 1, -1, 1, -1, 1]):
+        self.boxBounds = np.array(boxBounds)
+
+    def set_units(self, stackUnits=np.ones(3)):
+        self.stackUnits = np.array(stackUnits)
+
+    def set_modelView(self, modelView=mat4_identity()):
+        self.modelView = np.asarray(modelView, dtype=np.float32)
+
+    def set_projection(self, projection=mat4_perspective()):
+        self.projection = projection
+
+    def set_data(self, data):
+        """data = 3d numpy array, converted to float32 if necessary"""
+        data = np.ascontiguousarray(data, dtype=np.float32)
+
+        Nz, Ny, Nx = data.shape
+        self.dataShape = (Nx, Ny, Nz)
+
+        # CUDA array + texture object, giving hardware trilinear
+        # interpolation with normalized coordinates like the OpenCL path
+        ch = texture.ChannelFormatDescriptor(
+            32, 0, 0, 0, runtime.cudaChannelFormatKindFloat)
+        self._cuda_array = texture.CUDAarray(ch, Nx, Ny, Nz)
+        self._cuda_array.copy_from(data)
+
+        res = texture.ResourceDescriptor(runtime.cudaResourceTypeArray,
+                                         cuArr=self._cuda_array)
+        tex = texture.TextureDescriptor(
+            addressModes=(runtime.cudaAddressModeClamp,)*3,
+            filterMode=runtime.cudaFilterModeLinear,
+            readMode=runtime.cudaReadModeElementType,
+            normalizedCoords=1)
+        self._tex = texture.TextureObject(res, tex)
+
+    def _stack_scale_factors(self):
+        Nx, Ny, Nz = self.dataShape
+        dx, dy, dz = self.stackUnits
+
+        maxDim = max(d*N for d, N in zip([dx, dy, dz], [Nx, Ny, Nz]))
+        return 1.*dx*Nx/maxDim, 1.*dy*Ny/maxDim, 1.*dz*Nz/maxDim
+
+    def update_matrices(self):
+        invM = self._invM_host.reshape(4, 4)
+        inv4x4(np.ascontiguousarray(self.modelView, dtype=np.float32), invM)
+
+        # fold the diagonal stack scale into the rows of the inverse
+        sx, sy, sz = self._stack_scale_factors()
+        invM[0] /= sx
+        invM[1] /= sy
+        invM[2] /= sz
+
+        inv4x4(np.ascontiguousarray(self.projection, dtype=np.float32),
+               self._invP_host.reshape(4, 4))
+
+        self.invMBuf.set(self._invM_host)
+        self.invPBuf.set(self._invP_host)
+
+    def render(self, data=None, maxVal=None, minVal=None, gamma=None,
+               modelView=None, projection=None):
+        if data is not None:
+            self.set_data(data)
+        if maxVal is not None:
+            self.set_max_val(maxVal)
+        if minVal is not None:
+            self.set_min_val(minVal)
+        if gamma is not None:
+            self.set_gamma(gamma)
+        if modelView is not None:
+            self.set_modelView(modelView)
+        if projection is not None:
+            self.set_projection(projection)
+
+        if self._tex is None:
+            print("no data provided, set_data(data) before")
+            return
+
+        self.update_matrices()
+
+        params = np.zeros(16, dtype=np.float32)
+        params[:6] = self.boxBounds
+        params[6:9] = self.minVal, self.maxVal, self.gamma
+        self._params.set(params)
+
+        block = (16, 16, 1)
+        grid = ((self.width+block[0]-1)//block[0],
+                (self.height+block[1]-1)//block[1])
+        self._kernel(grid, block,
+                     (self.buf, np.int32(self.width), np.int32(self.height),
+                      self._params, self.invPBuf, self.invMBuf,
+                      self._tex))
+
+        self.output = cp.asnumpy(self.buf)
+        return self.output
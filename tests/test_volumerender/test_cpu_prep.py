@@ -0,0 +1,93 @@
+"""
+tests of the pure CPU helpers of the volume renderer - these need no
+OpenCL context
+
+mweigert@mpi-cbg.de
+"""
+from __future__ import print_function, unicode_literals, absolute_import, division
+
+import numpy as np
+
+from spimagine.volumerender._render_prep import inv4x4
+from spimagine.volumerender.volumerender import VolumeRenderer, _bayer_pattern
+from spimagine.utils import mat4_translate, mat4_perspective
+
+
+class _CPUStub(VolumeRenderer):
+    """stand in exposing the pure CPU methods of VolumeRenderer without
+    creating an OpenCL context"""
+
+    def __init__(self, dtype=np.float32):
+        self.dtype = dtype
+
+
+def test_inv4x4():
+    np.random.seed(42)
+    for _ in range(200):
+        m = np.random.uniform(-1, 1, (4, 4)).astype(np.float32)
+        if np.abs(np.linalg.det(m))<1.e-4:
+            continue
+        out = np.empty((4, 4), dtype=np.float32)
+        inv4x4(m, out)
+        assert np.allclose(np.dot(m, out), np.eye(4), atol=1.e-3)
+
+
+def test_bayer_pattern():
+    for n in (1, 2, 4):
+        b = _bayer_pattern(n)
+        assert b.shape==(2**n,)*2
+        # a permutation of k/size for k = 0 ... size-1
+        assert np.allclose(np.sort(b.ravel()), np.arange(b.size)/b.size)
+
+
+def test_block_average():
+    rend = _CPUStub(np.float32)
+    d = np.arange(4**3, dtype=np.float32).reshape((4,)*3)
+    out = rend._block_average(d, 2)
+    assert out.shape==(2,)*3
+    assert np.allclose(out[0, 0, 0], d[:2, :2, :2].mean())
+
+    # integer dtypes accumulate in a wide type and must not overflow
+    rend = _CPUStub(np.uint8)
+    d = 255*np.ones((4,)*3, dtype=np.uint8)
+    out = rend._block_average(d, 2)
+    assert out.dtype==np.uint8
+    assert np.all(out==255)
+
+
+def test_block_average_thin():
+    # dimensions smaller than the factor keep one voxel
+    np.random.seed(0)
+    rend = _CPUStub(np.float32)
+    d = np.random.uniform(0, 1, (2, 64, 64)).astype(np.float32)
+    out = rend._block_average(d, 4)
+    assert out.shape==(1, 16, 16)
+    assert np.allclose(out[0, 0, 0], d[:, :4, :4].mean(), atol=1.e-5)
+
+
+def test_render_rect():
+    rend = _CPUStub()
+    rend.boxBounds = np.array([-1, 1, -1, 1, -1, 1])
+    rend.stackUnits = np.ones(3)
+    # only the shape of dataImg is consumed
+    rend.dataImg = np.empty((64,)*3, dtype=np.float32)
+    rend.projection = mat4_perspective(60, 1., .1, 100)
+
+    # a box close to the camera covers the frame -> full launch
+    rend.modelView = mat4_translate(0, 0, -2.)
+    assert rend._compute_render_rect(400, 400) is None
+
+    # a distant box projects to a small centered rectangle
+    rend.modelView = mat4_translate(0, 0, -20.)
+    rect = rend._compute_render_rect(400, 400)
+    assert rect is not None
+    x0, y0, w, h = rect
+    assert 0<x0 and 0<y0 and x0+w<400 and y0+h<400
+
+
+if __name__=="__main__":
+    test_inv4x4()
+    test_bayer_pattern()
+    test_block_average()
+    test_block_average_thin()
+    test_render_rect()
@@ -195,6 +195,30 @@ def test_opacity():
 
     return rend
 
+def test_batched():
+    from spimagine.volumerender.volumerender import BatchedVolumeRenderer
+
+    N = 64
+    x = np.linspace(-1, 1, N)
+    Z, Y, X = np.meshgrid(x, x, x, indexing="ij")
+    d1 = np.exp(-10*((X-.4)**2+Y**2+Z**2)).astype(np.float32)
+    d2 = np.exp(-10*((X+.4)**2+Y**2+Z**2)).astype(np.float32)
+
+    rend = BatchedVolumeRenderer((400, 400))
+    rend.set_modelView(mat4_translate(0, 0, -10.))
+    rend.set_data([d1, d2])
+    out = rend.render(maxVal=1.)
+
+    # the batch accumulates the running maximum of the single renders
+    single = VolumeRenderer((400, 400))
+    single.set_modelView(mat4_translate(0, 0, -10.))
+    out1 = single.render(d1, maxVal=1.).copy()
+    out2 = single.render(d2, maxVal=1.).copy()
+    assert np.allclose(out, np.maximum(out1, out2), atol=1.e-4)
+
+    return out
+
+
 if __name__=="__main__":
     #rend = test_speed_multipass()
     #rend = test_linear_nearest_switch()